@@ -2,13 +2,20 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 from wqueue.request_queue import RequestQueue
-from generation.generator import ImageGenerator
+from generation.generator import ImageGenerator, GenerationCancelled
+from generation.draft_cache import DraftCache
 from utils.config import Config
 from utils.logger import Logger
 from utils.resource_scanner import ResourceScanner
+from utils.output_store import OutputStore
+from utils.settings import SettingsError
 import asyncio
+import functools
+import io
 import json
 import os
+import random
+import time
 from telegram.ext import ContextTypes
 
 class ImageGenerationBot:
@@ -17,9 +24,13 @@ class ImageGenerationBot:
         self.queue = RequestQueue()
         self.generator = ImageGenerator(config)
         self.resource_scanner = ResourceScanner(config)
+        self.draft_cache = DraftCache(config.draft_cache_size)
+        self.output_store = OutputStore(config)
         self.application = Application.builder().token(config.get('bot_token')).build()
         self.user_settings = {}
         self.last_settings = {}
+        # Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора до завершения
+        self.background_tasks = set()
 
         # Настройка логирования
         logging.basicConfig(
@@ -37,17 +48,18 @@ class ImageGenerationBot:
 
     async def show_interactive_panel(self, update: Update, context):
         user_id = update.effective_user.id
-        settings = self.user_settings.get(user_id, self.config.default_settings)
+        settings = self.get_settings(user_id)
         
         keyboard = [
             [InlineKeyboardButton("🚀 Начать генерацию", callback_data='start_generation')],
-            [InlineKeyboardButton(f"Модель: {settings['model']}", callback_data='change_model')],
-            [InlineKeyboardButton(f"VAE: {settings['vae']}", callback_data='change_vae')],
-            [InlineKeyboardButton(f"LoRA: {settings['lora']}", callback_data='change_lora')],
-            [InlineKeyboardButton(f"Семплер: {settings['sampler']}", callback_data='change_sampler')],
-            [InlineKeyboardButton(f"CFG Scale: {settings['cfg_scale']}", callback_data='change_cfg')],
-            [InlineKeyboardButton(f"Шаги: {settings['steps']}", callback_data='change_steps')],
-            [InlineKeyboardButton(f"Размер: {settings['size']}", callback_data='change_size')],
+            [InlineKeyboardButton("⚡ Черновик", callback_data='start_draft')],
+            [InlineKeyboardButton(f"Модель: {settings.model}", callback_data='change_model')],
+            [InlineKeyboardButton(f"VAE: {settings.vae}", callback_data='change_vae')],
+            [InlineKeyboardButton(f"LoRA: {settings.lora}", callback_data='change_lora')],
+            [InlineKeyboardButton(f"Семплер: {settings.sampler}", callback_data='change_sampler')],
+            [InlineKeyboardButton(f"CFG Scale: {settings.cfg_scale}", callback_data='change_cfg')],
+            [InlineKeyboardButton(f"Шаги: {settings.steps}", callback_data='change_steps')],
+            [InlineKeyboardButton(f"Размер: {settings.size}", callback_data='change_size')],
             [InlineKeyboardButton("Изменить промпт", callback_data='change_prompt')],
             [InlineKeyboardButton("Изменить негативный промпт", callback_data='change_negative_prompt')],
             [InlineKeyboardButton("Применить стандартные", callback_data='apply_default')]
@@ -65,7 +77,11 @@ class ImageGenerationBot:
                 if update.message:
                     await update.message.reply_text(message, reply_markup=reply_markup)
                 elif update.callback_query:
-                    await update.callback_query.message.edit_text(message, reply_markup=reply_markup)
+                    if update.callback_query.message.photo:
+                        # Сообщения с фото (черновик, результат) нельзя превратить в текстовые
+                        await update.callback_query.message.reply_text(message, reply_markup=reply_markup)
+                    else:
+                        await update.callback_query.message.edit_text(message, reply_markup=reply_markup)
             else:
                 await context.bot.send_message(chat_id=user_id, text=message, reply_markup=reply_markup)
         except Exception as e:
@@ -80,6 +96,14 @@ class ImageGenerationBot:
         try:
             if query.data == 'start_generation':
                 await self.start_generation(update, context)
+            elif query.data == 'start_draft':
+                await self.start_generation(update, context, draft=True)
+            elif query.data.startswith('cancel_'):
+                await self.cancel_job(update, context, int(query.data[7:]))
+            elif query.data.startswith('original_'):
+                await self.send_original(update, context, query.data[9:])
+            elif query.data.startswith('refine_'):
+                await self.refine_draft(update, context, int(query.data[7:]))
             elif query.data.startswith('change_'):
                 param = query.data[7:]  # Убираем 'change_' из начала
                 await self.change_parameter(update, context, param)
@@ -100,19 +124,22 @@ class ImageGenerationBot:
             self.logger.error(f"Error in handle_callback: {str(e)}")
             await query.message.reply_text("Произошла ошибка при обработке вашего запроса. Пожалуйста, попробуйте еще раз.")
 
+    def get_settings(self, user_id):
+        return self.user_settings.get(user_id, self.config.default_settings)
+
     async def change_parameter(self, update: Update, context, param):
         user_id = update.effective_user.id
-        settings = self.user_settings.get(user_id, self.config.default_settings)
+        settings = self.get_settings(user_id)
         
         if param in ['model', 'vae', 'lora', 'sampler']:
             options = getattr(self.resource_scanner, f'scan_{param}s')()
             keyboard = [[InlineKeyboardButton(option, callback_data=f'set_{param}_{option}')] for option in options]
         elif param in ['cfg', 'steps', 'size']:
             await update.callback_query.edit_message_text(f"Введите новое значение для {param}:")
-            context.user_data['expect_input'] = param
+            context.user_data['expect_input'] = 'cfg_scale' if param == 'cfg' else param
             return
         elif param in ['prompt', 'negative_prompt']:
-            current_value = settings.get(param, "Не задано")
+            current_value = getattr(settings, param) or "Не задано"
             await update.callback_query.edit_message_text(
                 f"Текущий {'промпт' if param == 'prompt' else 'негативный промпт'}:\n{current_value}\n\n"
                 f"Введите новый {'промпт' if param == 'prompt' else 'негативный промпт'}:"
@@ -127,10 +154,17 @@ class ImageGenerationBot:
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.callback_query.edit_message_text(f"Выберите {param}:", reply_markup=reply_markup)
 
+    def update_settings(self, user_id, **changes):
+        """Проверяет и применяет изменения настроек; при ошибке бросает SettingsError."""
+        self.user_settings[user_id] = self.get_settings(user_id).replace(**changes)
+
     async def set_parameter(self, update: Update, context, param, value):
         user_id = update.effective_user.id
-        self.user_settings.setdefault(user_id, self.config.default_settings.copy())
-        self.user_settings[user_id][param] = value
+        try:
+            self.update_settings(user_id, **{param: value})
+        except SettingsError as e:
+            await update.callback_query.message.reply_text(f"Неверное значение: {e}")
+            return
         await self.show_interactive_panel(update, context)
 
     async def handle_text_input(self, update: Update, context):
@@ -140,94 +174,172 @@ class ImageGenerationBot:
         if 'expect_input' in context.user_data:
             param = context.user_data['expect_input']
             del context.user_data['expect_input']
-            
-            if param in ['cfg_scale', 'steps']:
-                try:
-                    value = float(text) if param == 'cfg_scale' else int(text)
-                    self.user_settings.setdefault(user_id, self.config.default_settings.copy())
-                    self.user_settings[user_id][param] = value
-                    await self.show_interactive_panel(update, context)
-                except ValueError:
-                    await update.message.reply_text(f"Неверный формат. Пожалуйста, введите число для {param}.")
-            elif param == 'size':
-                try:
-                    width, height = map(int, text.split('x'))
-                    self.user_settings.setdefault(user_id, self.config.default_settings.copy())
-                    self.user_settings[user_id]['size'] = f"{width}x{height}"
-                    await self.show_interactive_panel(update, context)
-                except ValueError:
-                    await update.message.reply_text("Неверный формат. Пожалуйста, введите размер в формате ШИРИНАxВЫСОТА (например, 512x512).")
-            elif param in ['prompt', 'negative_prompt']:
-                self.user_settings.setdefault(user_id, self.config.default_settings.copy())
-                self.user_settings[user_id][param] = text
-                await self.show_interactive_panel(update, context)
         else:
             # Если это не ожидаемый ввод, считаем текст промптом и показываем панель настроек
-            self.user_settings.setdefault(user_id, self.config.default_settings.copy())
-            self.user_settings[user_id]['prompt'] = text
-            await self.show_interactive_panel(update, context)
+            param = 'prompt'
+
+        try:
+            self.update_settings(user_id, **{param: text})
+        except SettingsError as e:
+            await update.message.reply_text(f"Неверный формат. {e}")
+            return
+        await self.show_interactive_panel(update, context)
 
     async def apply_default_settings(self, update: Update, context):
         user_id = update.effective_user.id
-        self.user_settings[user_id] = self.config.default_settings.copy()
+        self.user_settings[user_id] = self.config.default_settings
         await self.show_interactive_panel(update, context)
 
     async def apply_last_settings(self, update: Update, context):
         user_id = update.effective_user.id
         if user_id in self.last_settings:
-            self.user_settings[user_id] = self.last_settings[user_id].copy()
+            self.user_settings[user_id] = self.last_settings[user_id]
         await self.show_interactive_panel(update, context)
 
-    async def start_generation(self, update: Update, context):
+    async def start_generation(self, update: Update, context, draft=False):
         user_id = update.effective_user.id
-        settings = self.user_settings.setdefault(user_id, self.config.default_settings.copy())
-        self.last_settings[user_id] = settings.copy()
+        settings = self.get_settings(user_id)
+        self.last_settings[user_id] = settings
         
-        await self.queue.add_task(self.generate_and_send, update, context, settings)
+        job = await self.enqueue_generation(update, context, settings, draft=draft)
+        if job is None:
+            return
         
-        if update.callback_query:
-            status_message = await update.callback_query.edit_message_text("🔄 Задача добавлена в очередь. Ожидайте начала генерации.")
+        text = "🔄 Задача добавлена в очередь. Ожидайте начала генерации."
+        if update.callback_query and update.callback_query.message.photo:
+            status_message = await update.callback_query.message.reply_text(text, reply_markup=self.cancel_markup(job))
+        elif update.callback_query:
+            status_message = await update.callback_query.edit_message_text(text, reply_markup=self.cancel_markup(job))
         else:
-            status_message = await update.message.reply_text("🔄 Задача добавлена в очередь. Ожидайте начала генерации.")
+            status_message = await update.message.reply_text(text, reply_markup=self.cancel_markup(job))
         
-        await self.update_queue_status(status_message)
+        # Обновление статуса не должно блокировать обработку других апдейтов (например, отмены)
+        task = asyncio.create_task(self.update_queue_status(status_message, job))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def enqueue_generation(self, update: Update, context, settings, draft=False, refine_from=None):
+        """Ставит генерацию в очередь; повторные нажатия с теми же настройками
+        схлопываются в уже существующую задачу. Возвращает None для дубликата."""
+        user_id = update.effective_user.id
+        key = (user_id, draft, refine_from, settings)
+        if self.queue.find(key) is not None:
+            await update.effective_message.reply_text("⏳ Такая задача уже в очереди.")
+            return None
+        return await self.queue.add_task(
+            self.generate_and_send, update, context, settings,
+            key=key, owner=user_id, draft=draft, refine_from=refine_from
+        )
+
+    def cancel_markup(self, job):
+        return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data=f'cancel_{job.id}')]])
 
-    async def update_queue_status(self, message):
+    async def cancel_job(self, update: Update, context, job_id):
+        user_id = update.effective_user.id
+        job = self.queue.get(job_id)
+        if job is not None and job.owner != user_id:
+            self.logger.warning(f"User {user_id} tried to cancel job {job_id} of user {job.owner}")
+            await update.callback_query.message.reply_text("Отменить задачу может только её автор.")
+            return
+        if self.queue.cancel(job_id, owner=user_id):
+            await update.callback_query.edit_message_text("❌ Задача отменена.")
+        else:
+            await update.callback_query.edit_message_reply_markup(reply_markup=None)
+            if job is not None and job.committed:
+                await update.callback_query.message.reply_text("Генерация уже завершена, результат отправляется.")
+
+    async def update_queue_status(self, message, job):
         try:
-            while self.queue.queue_size > 0:
-                await message.edit_text(f"🔄 Ваша задача в очереди.\nПозиция: {self.queue.queue_size}\nТекущая задача: {self.queue.current_task_name}\nВремя выполнения: {self.queue.elapsed_time:.2f}s")
+            while self.queue.position(job) > 0:
+                await message.edit_text(
+                    f"🔄 Ваша задача в очереди.\nПозиция: {self.queue.position(job)}\nТекущая задача: {self.queue.current_task_name}\nВремя выполнения: {self.queue.elapsed_time:.2f}s",
+                    reply_markup=self.cancel_markup(job)
+                )
                 await asyncio.sleep(5)
         except Exception as e:
             self.logger.error(f"Error updating queue status: {str(e)}")
 
-    async def update_status(self, message, text):
+    async def update_status(self, message, text, reply_markup=None):
         try:
-            await message.edit_text(f"{text}\nВ очереди: {self.queue.queue_size}\nВремя выполнения: {self.queue.elapsed_time:.2f}s")
+            await message.edit_text(f"{text}\nВ очереди: {self.queue.queue_size}\nВремя выполнения: {self.queue.elapsed_time:.2f}s", reply_markup=reply_markup)
         except Exception as e:
             self.logger.error(f"Error updating status: {str(e)}")
 
-    async def generate_and_send(self, update: Update, context, settings):
+    async def refine_draft(self, update: Update, context, draft_id):
+        user_id = update.effective_user.id
+        if self.draft_cache.get(user_id, draft_id) is None:
+            await update.callback_query.message.reply_text("Черновик устарел. Создайте новый черновик.")
+            return
+        job = await self.enqueue_generation(update, context, None, refine_from=draft_id)
+        if job is not None:
+            await update.callback_query.message.reply_text(
+                "🔄 Доработка черновика добавлена в очередь.",
+                reply_markup=self.cancel_markup(job)
+            )
+
+    async def send_draft(self, update: Update, status_message, image, latents, settings):
+        draft_id = status_message.message_id
+        self.draft_cache.put(update.effective_user.id, draft_id, latents, settings)
+
+        width, height = self.generator.draft_size(settings)
+        caption = (
+            f"⚡ Черновик {width}x{height}, seed {settings.seed}\n"
+            f"Доработать до {settings.size}?"
+        )
+        keyboard = [
+            [InlineKeyboardButton("✅ Доработать", callback_data=f'refine_{draft_id}')],
+            [InlineKeyboardButton("⚡ Другой черновик", callback_data='start_draft')],
+            [InlineKeyboardButton("✏️ Изменить", callback_data='modify_settings')]
+        ]
+
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        buffer.seek(0)
+        await update.effective_message.reply_photo(
+            photo=buffer,
+            caption=caption,
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+    async def generate_and_send(self, update: Update, context, settings, draft=False, refine_from=None, job=None):
+        status_message = None
+        cancel_event = job.cancel_event if job else None
+        reply_markup = self.cancel_markup(job) if job else None
         try:
             if update.callback_query:
-                status_message = await update.callback_query.message.reply_text("🔄 Подготовка к генерации...")
+                status_message = await update.callback_query.message.reply_text("🔄 Подготовка к генерации...", reply_markup=reply_markup)
             else:
-                status_message = await update.message.reply_text("🔄 Подготовка к генерации...")
-
-            model_name = settings.get('model', self.config.default_model)
-            model_type = settings.get('model_type', self.config.default_model_type)
-            vae_name = settings.get('vae', None)
+                status_message = await update.message.reply_text("🔄 Подготовка к генерации...", reply_markup=reply_markup)
+
+            draft_entry = None
+            if refine_from is not None:
+                draft_entry = self.draft_cache.get(update.effective_user.id, refine_from)
+                if draft_entry is None:
+                    await self.update_status(status_message, "Черновик устарел. Создайте новый черновик.")
+                    return
+                # Доработка использует настройки и seed черновика
+                settings = draft_entry['settings']
+            elif draft and settings.seed is None:
+                settings = settings.replace(seed=random.randint(0, settings.MAX_SEED))
+
+            model_name = settings.model
+            model_type = self.config.default_model_type
+            vae_name = settings.vae
 
             print(f"Загружается модель: {model_name} (Тип: {model_type})")
 
             if self.generator.model is None or (self.generator.model.config and self.generator.model.config.get('name') != model_name):
-                await self.update_status(status_message, f"🔄 Загрузка модели: {model_name} (Тип: {model_type})")
+                await self.update_status(status_message, f"🔄 Загрузка модели: {model_name} (Тип: {model_type})", reply_markup)
                 await self.generator.load_model(model_name, vae_name=vae_name)
 
-            if settings.get('lora'):
-                await self.update_status(status_message, "🔄 Загрузка LoRA...")
-                await self.generator.load_lora(settings['lora'])
+            if settings.lora:
+                await self.update_status(status_message, "🔄 Загрузка LoRA...", reply_markup)
+                await self.generator.load_lora(settings.lora)
+
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled()
 
-            await self.update_status(status_message, "🚀 Генерация началась...")
+            await self.update_status(status_message, "🚀 Генерация началась...", reply_markup)
 
             # async def progress_callback(progress, elapsed_time, remaining_time, speed):
             #     try:
@@ -247,14 +359,36 @@ class ImageGenerationBot:
             #         print(f"ERROR in progress_callback: {e}")
 
             # image = await self.generator.generate_image(settings, progress_callback=progress_callback)
-            image = await self.generator.generate_image(settings)
+            if draft:
+                image, latents = await self.generator.generate_draft(settings, cancel_event=cancel_event)
+                if job is not None and not job.commit():
+                    raise GenerationCancelled()
+                await self.update_status(status_message, "✅ Черновик готов!")
+                await self.send_draft(update, status_message, image, latents, settings)
+                return
 
-            await self.update_status(status_message, "✅ Генерация завершена!")
+            if draft_entry is not None:
+                image = await self.generator.refine_draft(settings, draft_entry['latents'], cancel_event=cancel_event)
+            else:
+                image = await self.generator.generate_image(settings, cancel_event=cancel_event)
 
-            output_path = os.path.join(self.config.output_path, f"{update.effective_user.id}_{update.effective_message.message_id}.png")
-            image.save(output_path)
+            # Дальше результат только сохраняется и отправляется: отмена больше невозможна
+            if job is not None and not job.commit():
+                raise GenerationCancelled()
 
-            metadata = json.dumps(settings, indent=2, ensure_ascii=False)
+            await self.update_status(status_message, "✅ Генерация завершена!")
+
+            # Кодирование PNG не должно блокировать event loop
+            output_path = await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                self.output_store.save,
+                f"{update.effective_user.id}_{status_message.message_id}",
+                update.effective_user.id,
+                image,
+                settings.to_dict()
+            ))
+            self.output_store.check_budget()
+
+            metadata = json.dumps(settings.to_dict(), indent=2, ensure_ascii=False)
             caption = f"🎉 Вот ваше изображение!\n\n📄 Метаданные:\n{metadata}"
             
             keyboard = [
@@ -272,10 +406,52 @@ class ImageGenerationBot:
 
             self.logger.info(f"Image generated successfully for user {update.effective_user.id}")
 
+        except GenerationCancelled:
+            if status_message is not None:
+                await self.update_status(status_message, "❌ Генерация отменена.")
+            self.logger.info(f"Generation cancelled by user {update.effective_user.id}")
         except Exception as e:
             await update.effective_message.reply_text(f"Произошла ошибка: {str(e)}")
             self.logger.error(f"Error during image generation: {str(e)}")
 
+    async def history_command(self, update: Update, context):
+        user_id = update.effective_user.id
+        try:
+            limit = max(1, min(int(context.args[0]), 10)) if context.args else 5
+        except ValueError:
+            await update.message.reply_text("Пожалуйста, укажите количество изображений числом.")
+            return
+
+        entries = self.output_store.history(user_id, limit)
+        if not entries:
+            await update.message.reply_text("История пуста.")
+            return
+
+        loop = asyncio.get_running_loop()
+        for entry in entries:
+            thumbnail_path = await loop.run_in_executor(None, self.output_store.thumbnail, entry['job_id'])
+            if thumbnail_path is None:
+                continue
+            created = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created']))
+            prompt = entry['settings'].get('prompt', '')
+            caption = f"🕒 {created}\n🎲 Seed: {entry['seed']}\n📝 {prompt[:200]}"
+            keyboard = [[InlineKeyboardButton("📥 Оригинал", callback_data=f"original_{entry['job_id']}")]]
+            with open(thumbnail_path, 'rb') as thumbnail_file:
+                await update.message.reply_photo(
+                    photo=thumbnail_file,
+                    caption=caption,
+                    reply_markup=InlineKeyboardMarkup(keyboard)
+                )
+        self.output_store.check_budget()
+
+    async def send_original(self, update: Update, context, job_id):
+        entry = self.output_store.get(job_id)
+        if entry is None or entry['user_id'] != update.effective_user.id or not os.path.exists(entry['path']):
+            await update.callback_query.message.reply_text("Файл больше недоступен: он удалён по сроку хранения.")
+            return
+        with open(entry['path'], 'rb') as image_file:
+            await update.callback_query.message.reply_document(document=image_file)
+
     async def help_command(self, update: Update, context):
         help_text = """
         🤖 Добро пожаловать в бот генерации изображений!
@@ -283,6 +459,7 @@ class ImageGenerationBot:
         Доступные команды:
         /start или /s - Показать интерактивную панель настроек
         /generate или /g - Начать генерацию с текущими настройками
+        /history [n] - Показать миниатюры последних n изображений
         /help или /h - Показать это сообщение
 
         Команды для быстрой настройки параметров:
@@ -305,6 +482,7 @@ class ImageGenerationBot:
         self.application.add_handler(CommandHandler(["generate", "g"], self.start_generation))
         self.application.add_handler(CommandHandler(["help", "h"], self.help_command))
         self.application.add_handler(CommandHandler("clear", self.clear))
+        self.application.add_handler(CommandHandler("history", self.history_command))
         self.application.add_handler(CallbackQueryHandler(self.handle_callback))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_input))
         
@@ -334,12 +512,16 @@ class ImageGenerationBot:
             
             self.logger.info("Bot started, waiting for messages")
             queue_task = asyncio.create_task(self.queue.process_queue())
+            eviction_task = asyncio.create_task(self.output_store.run_eviction())
             
             # try:
             #     await self.application.updater.wait_closed()
             # finally:
-            await asyncio.Event().wait() 
-            await queue_task
+            try:
+                await asyncio.Event().wait() 
+                await queue_task
+            finally:
+                eviction_task.cancel()
 
     async def set_parameter_command(self, update: Update, context, param):
         user_id = update.effective_user.id
@@ -348,22 +530,11 @@ class ImageGenerationBot:
             return
         
         value = ' '.join(context.args)
-        self.user_settings.setdefault(user_id, self.config.default_settings.copy())
-        
-        if param in ['cfg_scale', 'steps', 'size']:
-            try:
-                if param == 'cfg_scale':
-                    self.user_settings[user_id][param] = float(value)
-                elif param == 'steps':
-                    self.user_settings[user_id][param] = int(value)
-                elif param == 'size':
-                    width, height = map(int, value.split('x'))
-                    self.user_settings[user_id][param] = f"{width}x{height}"
-            except ValueError:
-                await update.message.reply_text(f"Неверный формат для {param}. Попробуйте еще раз.")
-                return
-        else:
-            self.user_settings[user_id][param] = value
+        try:
+            self.update_settings(user_id, **{param: value})
+        except SettingsError as e:
+            await update.message.reply_text(f"Неверный формат для {param}: {e}")
+            return
         
         await update.message.reply_text(f"{param.capitalize()} установлен на {value}.")
         await self.show_interactive_panel(update, context)
@@ -407,9 +578,13 @@ class ImageGenerationBot:
     async def repeat_generation(self, update: Update, context):
         user_id = update.effective_user.id
         if user_id in self.last_settings:
-            settings = self.last_settings[user_id].copy()
-            await self.queue.add_task(self.generate_and_send, update, context, settings)
-            await update.callback_query.message.reply_text("🔄 Задача добавлена в очередь. Ожидайте начала генерации.")
+            settings = self.last_settings[user_id]
+            job = await self.enqueue_generation(update, context, settings)
+            if job is not None:
+                await update.callback_query.message.reply_text(
+                    "🔄 Задача добавлена в очередь. Ожидайте начала генерации.",
+                    reply_markup=self.cancel_markup(job)
+                )
         else:
             await update.callback_query.message.reply_text("Нет доступных настроек для повтора генерации.")
 
@@ -0,0 +1,34 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from utils.settings import GenerationSettings
+
+
+class DraftCache:
+    """Ограниченный по размеру кэш латентов черновиков для каждого пользователя.
+
+    Латенты хранятся на CPU; при превышении лимита вытесняется самый старый черновик.
+    """
+
+    def __init__(self, max_per_user: int = 4):
+        self.max_per_user = max_per_user
+        self.drafts: Dict[int, OrderedDict] = {}
+
+    def put(self, user_id: int, draft_id: int, latents, settings: GenerationSettings):
+        user_drafts = self.drafts.setdefault(user_id, OrderedDict())
+        user_drafts[draft_id] = {'latents': latents, 'settings': settings}
+        user_drafts.move_to_end(draft_id)
+        while len(user_drafts) > self.max_per_user:
+            user_drafts.popitem(last=False)
+
+    def get(self, user_id: int, draft_id: int) -> Optional[Dict[str, Any]]:
+        user_drafts = self.drafts.get(user_id)
+        if not user_drafts or draft_id not in user_drafts:
+            return None
+        user_drafts.move_to_end(draft_id)
+        return user_drafts[draft_id]
+
+    def clear(self, user_id: int = None):
+        if user_id is None:
+            self.drafts.clear()
+        else:
+            self.drafts.pop(user_id, None)
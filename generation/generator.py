@@ -1,9 +1,15 @@
 import asyncio
+import functools
 import time
 import torch
-from diffusers import StableDiffusionPipeline, StableDiffusionXLPipeline, AutoPipelineForText2Image, DPMSolverMultistepScheduler, AutoencoderKL
-from typing import Dict, Any
+import torch.nn.functional as F
+from diffusers import StableDiffusionPipeline, StableDiffusionXLPipeline, AutoPipelineForText2Image, AutoPipelineForImage2Image, DPMSolverMultistepScheduler, AutoencoderKL
+from typing import Tuple
 import os
+from utils.settings import GenerationSettings
+
+class GenerationCancelled(Exception):
+    """Генерация прервана пользователем на границе шага."""
 
 class ImageGenerator:
     def __init__(self, config):
@@ -13,6 +19,7 @@ class ImageGenerator:
         self.scheduler = None
         self.vae = None
         self.compiled_model = None
+        self.img2img_model = None
 
     def parse_model_data(self, model_data):
         model_type, model_name = model_data.split("#", 1)
@@ -24,6 +31,8 @@ class ImageGenerator:
         if not os.path.exists(model_path):
             model_path = model_name  # HuggingFace модель
 
+        self.img2img_model = None
+
         # Выбор пайплайна в зависимости от типа модели
         pipeline_class = StableDiffusionXLPipeline if model_type in ['pony', 'xl'] else StableDiffusionPipeline
 
@@ -92,29 +101,111 @@ class ImageGenerator:
             self.model.load_lora_weights(lora_path)
             self.model.fuse_lora(alpha=alpha)
 
-    async def generate_image(self, params: Dict[str, Any], progress_callback=None):
+    def _seed_generator(self, settings: GenerationSettings):
+        return torch.manual_seed(settings.seed) if settings.seed is not None else None
+
+    def _run_pipeline(self, pipeline, cancel_event=None, captured=None, **kwargs):
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            # Граница шага: здесь можно безопасно прервать генерацию
+            if cancel_event is not None and cancel_event.is_set():
+                raise GenerationCancelled()
+            if captured is not None:
+                captured['latents'] = callback_kwargs['latents']
+            return callback_kwargs
+
+        with torch.inference_mode(), torch.amp.autocast('cuda', enabled=True):
+            return pipeline(callback_on_step_end=on_step_end, **kwargs)
+
+    async def _call_pipeline(self, pipeline, cancel_event=None, captured=None, **kwargs):
+        # Пайплайн выполняется в отдельном потоке, чтобы event loop бота
+        # продолжал обрабатывать сообщения (в том числе кнопку отмены)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                None, functools.partial(self._run_pipeline, pipeline, cancel_event, captured, **kwargs)
+            )
+        finally:
+            torch.cuda.empty_cache()
+
+    async def generate_image(self, settings: GenerationSettings, progress_callback=None, cancel_event=None):
         if not self.model:
             raise ValueError("Model not loaded")
 
-        width, height = map(int, params.get('size', '512x768').split('x'))
         start_time = time.time()
 
-        # Ensure prompt and negative_prompt are strings
-        prompt = str(params.get('prompt', 'masterpiece, best quality, 1girl, beautiful, dynamic pose'))
-        negative_prompt = str(params.get('negative_prompt', '(worst quality:1.2), (low quality:1.2), (lowres:1.1), (monochrome:1.1), (greyscale), multiple views, comic, sketch, missing fingers'))
+        result = await self._call_pipeline(
+            self.model,
+            cancel_event,
+            prompt=settings.prompt,
+            negative_prompt=settings.negative_prompt,
+            num_inference_steps=settings.steps,
+            guidance_scale=settings.cfg_scale,
+            width=settings.width,
+            height=settings.height,
+            generator=self._seed_generator(settings),
+        )
 
-        with torch.inference_mode(), torch.amp.autocast('cuda', enabled=True):
-            result = self.model(
-                prompt=prompt,
-                negative_prompt=negative_prompt,
-                num_inference_steps=int(params.get('steps', 24)),
-                guidance_scale=float(params.get('cfg_scale', 7.0)),
-                width=width,
-                height=height,
-                generator=torch.manual_seed(params['seed']) if params.get('seed') is not None else None,
-            )
+        return result.images[0]
+
+    def draft_size(self, settings: GenerationSettings) -> Tuple[int, int]:
+        scale = self.config.draft_scale
+        # UNet требует размеры, кратные 64 пикселям (8 в латентном пространстве);
+        # черновик не должен быть больше целевого размера
+        return (min(settings.width // 64 * 64, max(256, int(settings.width * scale) // 64 * 64)),
+                min(settings.height // 64 * 64, max(256, int(settings.height * scale) // 64 * 64)))
+
+    async def generate_draft(self, settings: GenerationSettings, cancel_event=None):
+        """Быстрый черновик: мало шагов и уменьшенный размер.
+
+        Возвращает изображение для предпросмотра и латенты последнего шага,
+        которые затем передаются в refine_draft.
+        """
+        if not self.model:
+            raise ValueError("Model not loaded")
+
+        width, height = self.draft_size(settings)
+        captured = {}
+
+        result = await self._call_pipeline(
+            self.model,
+            cancel_event,
+            captured,
+            prompt=settings.prompt,
+            negative_prompt=settings.negative_prompt,
+            num_inference_steps=min(self.config.draft_steps, settings.steps),
+            guidance_scale=settings.cfg_scale,
+            width=width,
+            height=height,
+            generator=self._seed_generator(settings),
+        )
+
+        latents = captured['latents'].detach().to('cpu')
+        return result.images[0], latents
+
+    async def refine_draft(self, settings: GenerationSettings, latents, cancel_event=None):
+        """Доработка черновика: апскейл латентов до целевого размера и img2img."""
+        if not self.model:
+            raise ValueError("Model not loaded")
+
+        if self.img2img_model is None:
+            # from_pipe переиспользует уже загруженные компоненты без копирования весов
+            self.img2img_model = AutoPipelineForImage2Image.from_pipe(self.model)
+
+        latents = latents.to(self.device, dtype=self.model.unet.dtype)
+        latents = F.interpolate(latents, size=(settings.height // 8, settings.width // 8), mode='bilinear', align_corners=False)
+
+        result = await self._call_pipeline(
+            self.img2img_model,
+            cancel_event,
+            prompt=settings.prompt,
+            negative_prompt=settings.negative_prompt,
+            image=latents,
+            strength=self.config.refine_strength,
+            num_inference_steps=settings.steps,
+            guidance_scale=settings.cfg_scale,
+            generator=self._seed_generator(settings),
+        )
 
-        torch.cuda.empty_cache()
         return result.images[0]
 
     def unload_model(self):
@@ -122,6 +213,7 @@ class ImageGenerator:
             del self.model
             del self.scheduler
             del self.vae
+            self.img2img_model = None
             torch.cuda.empty_cache()
             self.model = None
             self.scheduler = None
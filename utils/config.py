@@ -1,10 +1,52 @@
+import logging
+import os
 import yaml
 from typing import Dict, Any
+from utils.settings import GenerationSettings
+
+logger = logging.getLogger(__name__)
 
 class Config:
     def __init__(self, config_path: str):
-        with open(config_path, 'r') as config_file:
-            self.config = yaml.safe_load(config_file)
+        self.config_path = config_path
+        self.mtime = None
+        # mtime версии файла, которую не удалось загрузить (None — файл отсутствует),
+        # чтобы не разбирать её и не предупреждать повторно при каждом обращении
+        self._failed_mtime = False
+        self._default_settings = None
+        self.reload_if_changed()
+
+    def reload_if_changed(self) -> bool:
+        """Перечитывает файл конфигурации, если он изменился с последней загрузки.
+
+        Если файл недоступен или некорректен (например, редактор ещё не дописал его),
+        остаётся последняя рабочая конфигурация. При первой загрузке ошибка пробрасывается.
+        """
+        first_load = self.mtime is None
+        mtime = None
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+            if mtime == self.mtime or mtime == self._failed_mtime:
+                return False
+            with open(self.config_path, 'r') as config_file:
+                config = yaml.safe_load(config_file)
+            if not isinstance(config, dict):
+                raise ValueError("ожидается словарь параметров")
+            default_settings = self._build_default_settings(config)
+        except (OSError, yaml.YAMLError, ValueError, KeyError) as e:
+            if first_load:
+                raise
+            if mtime == self._failed_mtime:
+                return False
+            self._failed_mtime = mtime
+            logger.warning(f"Failed to reload config {self.config_path}, keeping previous: {e}")
+            return False
+
+        self.config = config
+        self.mtime = mtime
+        self._failed_mtime = False
+        self._default_settings = default_settings
+        return True
 
     def get(self, key: str, default: Any = None) -> Any:
         return self.config.get(key, default)
@@ -42,18 +84,23 @@ class Config:
         return self.config['default_model_type']
     
     @property
-    def default_settings(self) -> str:
-        return {
-            'model': self.config['default_model'],
-            'vae': 'default',
-            'lora': 'None',
-            'sampler': 'Euler a',
-            'cfg_scale': 7.0,
-            'steps': 24,
-            'size': '512x768',
-            'prompt': 'masterpiece, best quality, 1girl',
-            'negative_prompt': 'lowres, text, jpeg artifacts, ugly, (worst quality, low quality, bad quality), (blurry), missing fingers, extra fingers, extra legs, extra hands'
-        }
+    def default_settings(self) -> GenerationSettings:
+        self.reload_if_changed()
+        return self._default_settings
+
+    @staticmethod
+    def _build_default_settings(config: Dict[str, Any]) -> GenerationSettings:
+        return GenerationSettings(
+            model=config['default_model'],
+            vae='default',
+            lora='None',
+            sampler='Euler a',
+            cfg_scale=7.0,
+            steps=24,
+            size='512x768',
+            prompt='masterpiece, best quality, 1girl',
+            negative_prompt='lowres, text, jpeg artifacts, ugly, (worst quality, low quality, bad quality), (blurry), missing fingers, extra fingers, extra legs, extra hands'
+        )
 
     @property
     def default_precision(self) -> str:
@@ -61,4 +108,32 @@ class Config:
 
     @property
     def use_xformers(self) -> bool:
-        return self.config['use_xformers']
\ No newline at end of file
+        return self.config['use_xformers']
+
+    @property
+    def output_max_size_mb(self) -> int:
+        return int(self.config.get('output_max_size_mb', 2048))
+
+    @property
+    def output_max_age_days(self) -> float:
+        return float(self.config.get('output_max_age_days', 30))
+
+    @property
+    def thumbnail_size(self) -> int:
+        return int(self.config.get('thumbnail_size', 256))
+
+    @property
+    def draft_steps(self) -> int:
+        return int(self.config.get('draft_steps', 8))
+
+    @property
+    def draft_scale(self) -> float:
+        return float(self.config.get('draft_scale', 0.5))
+
+    @property
+    def refine_strength(self) -> float:
+        return float(self.config.get('refine_strength', 0.55))
+
+    @property
+    def draft_cache_size(self) -> int:
+        return int(self.config.get('draft_cache_size', 4))
\ No newline at end of file
@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from PIL import Image
+
+class OutputStore:
+    """Хранилище результатов генерации.
+
+    Файлы раскладываются по шардированным каталогам (ab/cd/<job_id>.png),
+    чтобы ни в одном каталоге не скапливались сотни тысяч файлов. Индекс
+    job -> файл, настройки, seed хранится в SQLite рядом с файлами. Бюджеты
+    по размеру и возрасту соблюдаются фоновым вытеснением самых старых записей.
+    """
+
+    INDEX_NAME = 'index.sqlite3'
+    THUMBNAIL_SUFFIX = '.thumb.jpg'
+    # Версия схемы индекса (PRAGMA user_version); 1 — старые файлы импортированы
+    LEGACY_IMPORTED_VERSION = 1
+
+    def __init__(self, config):
+        self.root = config.output_path
+        self.max_bytes = config.output_max_size_mb * 1024 * 1024
+        self.max_age = config.output_max_age_days * 24 * 60 * 60
+        self.thumbnail_size = config.thumbnail_size
+        os.makedirs(self.root, exist_ok=True)
+
+        # Индекс используется и из event loop, и из потока вытеснения
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(self.root, self.INDEX_NAME), check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS outputs ("
+                "job_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, path TEXT NOT NULL, "
+                "settings TEXT NOT NULL, seed INTEGER, size INTEGER NOT NULL, created REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS outputs_user_created ON outputs (user_id, created)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS outputs_created ON outputs (created)")
+            self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM outputs").fetchone()[0]
+
+        self.eviction_needed = asyncio.Event()
+
+    def _relative_path(self, job_id: str) -> str:
+        digest = hashlib.sha1(job_id.encode('utf-8')).hexdigest()
+        return os.path.join(digest[:2], digest[2:4], f"{job_id}.png")
+
+    def _absolute_path(self, relative_path: str) -> str:
+        return os.path.join(self.root, relative_path)
+
+    def _row_to_dict(self, row) -> Dict[str, Any]:
+        job_id, user_id, path, settings, seed, size, created = row
+        return {
+            'job_id': job_id,
+            'user_id': user_id,
+            'path': self._absolute_path(path),
+            'settings': json.loads(settings),
+            'seed': seed,
+            'size': size,
+            'created': created,
+        }
+
+    def save(self, job_id: str, user_id: int, image, settings: Dict[str, Any]) -> str:
+        relative_path = self._relative_path(job_id)
+        path = self._absolute_path(relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        image.save(path)
+        size = os.path.getsize(path)
+
+        with self.lock, self.db:
+            previous = self.db.execute("SELECT size FROM outputs WHERE job_id = ?", (job_id,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO outputs (job_id, user_id, path, settings, seed, size, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, relative_path, json.dumps(settings, ensure_ascii=False),
+                 settings.get('seed'), size, time.time())
+            )
+            self.total_bytes += size - (previous[0] if previous else 0)
+        return path
+
+    def check_budget(self):
+        """Будит фоновое вытеснение при превышении бюджета. Вызывается из event loop,
+        так как save() и thumbnail() выполняются в потоке executor."""
+        if self.total_bytes > self.max_bytes:
+            self.eviction_needed.set()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.db.execute("SELECT * FROM outputs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_dict(row) if row else None
+
+    def history(self, user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM outputs WHERE user_id = ? ORDER BY created DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def thumbnail(self, job_id: str) -> Optional[str]:
+        """Возвращает путь к миниатюре, создавая её при первом обращении."""
+        entry = self.get(job_id)
+        if entry is None or not os.path.exists(entry['path']):
+            return None
+
+        thumbnail_path = entry['path'][:-len('.png')] + self.THUMBNAIL_SUFFIX
+        if not os.path.exists(thumbnail_path):
+            with Image.open(entry['path']) as image:
+                image.thumbnail((self.thumbnail_size, self.thumbnail_size))
+                image.convert('RGB').save(thumbnail_path, format='JPEG', quality=85)
+            thumbnail_bytes = os.path.getsize(thumbnail_path)
+            # Миниатюра учитывается в бюджете вместе с оригиналом
+            with self.lock, self.db:
+                cursor = self.db.execute("UPDATE outputs SET size = size + ? WHERE job_id = ?", (thumbnail_bytes, job_id))
+                if cursor.rowcount:
+                    self.total_bytes += thumbnail_bytes
+            if not cursor.rowcount:
+                # Запись вытеснена, пока создавалась миниатюра
+                try:
+                    os.remove(thumbnail_path)
+                except FileNotFoundError:
+                    pass
+                return None
+        return thumbnail_path
+
+    def import_legacy(self) -> int:
+        """Однократно добавляет в индекс файлы {user_id}_{message_id}.png,
+        сохранённые в корень output_path до появления хранилища.
+
+        Файлы не переносятся, а индексируются на месте с датой по mtime, чтобы
+        на них распространялись бюджеты и вытеснение. Возвращает число импортированных файлов.
+        """
+        with self.lock:
+            if self.db.execute("PRAGMA user_version").fetchone()[0] >= self.LEGACY_IMPORTED_VERSION:
+                return 0
+
+        imported = 0
+        batch = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                name = entry.name
+                if not name.endswith('.png') or not entry.is_file():
+                    continue
+                user_id, _, message_id = name[:-len('.png')].partition('_')
+                if not (user_id.isdigit() and message_id.isdigit()):
+                    continue
+                stat = entry.stat()
+                batch.append((name[:-len('.png')], int(user_id), name, '{}', None, stat.st_size, stat.st_mtime))
+                if len(batch) >= 1000:
+                    imported += self._insert_legacy(batch)
+                    batch = []
+        imported += self._insert_legacy(batch)
+
+        with self.lock, self.db:
+            self.db.execute(f"PRAGMA user_version = {self.LEGACY_IMPORTED_VERSION}")
+        return imported
+
+    def _insert_legacy(self, rows) -> int:
+        if not rows:
+            return 0
+        with self.lock, self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO outputs (job_id, user_id, path, settings, seed, size, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM outputs").fetchone()[0]
+            return self.db.total_changes - before
+
+    def _remove_files(self, relative_path: str):
+        path = self._absolute_path(relative_path)
+        for file_path in (path, path[:-len('.png')] + self.THUMBNAIL_SUFFIX):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self) -> int:
+        """Удаляет записи старше бюджета по возрасту, затем самые старые,
+        пока общий размер не уложится в бюджет. Возвращает число удалённых записей."""
+        cutoff = time.time() - self.max_age
+        with self.lock:
+            expired = self.db.execute(
+                "SELECT job_id, path, size FROM outputs WHERE created < ?", (cutoff,)
+            ).fetchall()
+            victims = list(expired)
+            remaining = self.total_bytes - sum(size for _, _, size in expired)
+            if remaining > self.max_bytes:
+                cursor = self.db.execute(
+                    "SELECT job_id, path, size FROM outputs WHERE created >= ? ORDER BY created", (cutoff,)
+                )
+                for row in cursor:
+                    if remaining <= self.max_bytes:
+                        break
+                    victims.append(row)
+                    remaining -= row[2]
+
+            with self.db:
+                self.db.executemany("DELETE FROM outputs WHERE job_id = ?", [(job_id,) for job_id, _, _ in victims])
+            self.total_bytes = remaining
+
+        for _, path, _ in victims:
+            self._remove_files(path)
+        return len(victims)
+
+    async def run_eviction(self, interval: float = 3600):
+        """Фоновое вытеснение: раз в interval секунд или сразу при превышении бюджета."""
+        loop = asyncio.get_running_loop()
+        # Сначала забираем в индекс старые файлы и сразу применяем к ним бюджеты
+        await loop.run_in_executor(None, self.import_legacy)
+        await loop.run_in_executor(None, self.evict)
+        while True:
+            try:
+                await asyncio.wait_for(self.eviction_needed.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            self.eviction_needed.clear()
+            await loop.run_in_executor(None, self.evict)
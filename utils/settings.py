@@ -0,0 +1,134 @@
+from typing import Any, Dict, Optional, Tuple, Union
+
+class SettingsError(ValueError):
+    """Недопустимое значение параметра генерации."""
+
+class GenerationSettings:
+    """Неизменяемый набор параметров генерации.
+
+    Значения разбираются и проверяются один раз при создании, поэтому
+    генератору не нужно повторно приводить типы. Объект хешируемый и может
+    служить ключом кэшей и очереди.
+    """
+
+    # Поля, по которым определяются равенство и хеш
+    _KEY_FIELDS = ('model', 'vae', 'lora', 'sampler', 'cfg_scale', 'steps',
+                   'width', 'height', 'prompt', 'negative_prompt', 'seed')
+
+    __slots__ = _KEY_FIELDS + ('_hash',)
+
+    FIELDS = ('model', 'vae', 'lora', 'sampler', 'cfg_scale', 'steps',
+              'size', 'prompt', 'negative_prompt', 'seed')
+
+    MIN_STEPS, MAX_STEPS = 1, 150
+    MIN_CFG_SCALE, MAX_CFG_SCALE = 0.0, 30.0
+    MIN_SIZE, MAX_SIZE = 64, 2048
+    MAX_SEED = 2**32 - 1
+
+    def __init__(self, model: str, vae: str = 'default', lora: str = 'None', sampler: str = 'Euler a',
+                 cfg_scale: Union[float, str] = 7.0, steps: Union[int, str] = 24,
+                 size: Union[str, Tuple[int, int]] = '512x768', prompt: str = '',
+                 negative_prompt: str = '', seed: Optional[Union[int, str]] = None):
+        width, height = self._parse_size(size)
+        values = {
+            'model': self._parse_model(model),
+            'vae': self._parse_text('vae', vae),
+            'lora': self._parse_text('lora', lora),
+            'sampler': self._parse_text('sampler', sampler, allow_empty=False),
+            'cfg_scale': self._parse_number('cfg_scale', cfg_scale, float, self.MIN_CFG_SCALE, self.MAX_CFG_SCALE),
+            'steps': self._parse_number('steps', steps, int, self.MIN_STEPS, self.MAX_STEPS),
+            'width': width,
+            'height': height,
+            'prompt': self._parse_text('prompt', prompt),
+            'negative_prompt': self._parse_text('negative_prompt', negative_prompt),
+            'seed': None if seed is None or seed == '' else self._parse_number('seed', seed, int, 0, self.MAX_SEED),
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_hash', hash(self._key()))
+
+    @staticmethod
+    def _parse_text(name: str, value: Any, allow_empty: bool = True) -> str:
+        if not isinstance(value, str):
+            raise SettingsError(f"{name}: ожидается строка")
+        if not allow_empty and not value.strip():
+            raise SettingsError(f"{name}: значение не может быть пустым")
+        return value
+
+    @classmethod
+    def _parse_model(cls, value: Any) -> str:
+        # Формат модели — "тип#имя", как ожидает ImageGenerator.parse_model_data
+        model = cls._parse_text('model', value, allow_empty=False)
+        model_type, separator, model_name = model.partition('#')
+        if not separator or not model_type.strip() or not model_name.strip():
+            raise SettingsError("model: ожидается формат ТИП#ИМЯ (например, sd1#model.safetensors)")
+        return model
+
+    @staticmethod
+    def _parse_number(name: str, value: Any, kind: type, minimum, maximum):
+        if isinstance(value, bool):
+            raise SettingsError(f"{name}: ожидается число")
+        try:
+            number = kind(value)
+        except (TypeError, ValueError):
+            raise SettingsError(f"{name}: ожидается {'целое ' if kind is int else ''}число") from None
+        if not minimum <= number <= maximum:
+            raise SettingsError(f"{name}: значение должно быть от {minimum} до {maximum}")
+        return number
+
+    @classmethod
+    def _parse_size(cls, size: Union[str, Tuple[int, int]]) -> Tuple[int, int]:
+        try:
+            if isinstance(size, str):
+                width, height = map(int, size.lower().replace('×', 'x').split('x'))
+            else:
+                width, height = map(int, size)
+        except (TypeError, ValueError):
+            raise SettingsError("size: ожидается формат ШИРИНАxВЫСОТА (например, 512x512)") from None
+        for side in (width, height):
+            if not cls.MIN_SIZE <= side <= cls.MAX_SIZE:
+                raise SettingsError(f"size: стороны должны быть от {cls.MIN_SIZE} до {cls.MAX_SIZE}")
+            if side % 8:
+                raise SettingsError("size: стороны должны быть кратны 8")
+        return width, height
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'GenerationSettings':
+        return cls(**{name: data[name] for name in cls.FIELDS if name in data})
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def replace(self, **changes) -> 'GenerationSettings':
+        """Возвращает копию с изменёнными параметрами; значения проходят ту же проверку."""
+        unknown = set(changes) - set(self.FIELDS)
+        if unknown:
+            raise SettingsError(f"Неизвестный параметр: {', '.join(sorted(unknown))}")
+        data = self.to_dict()
+        data.update(changes)
+        return self.from_dict(data)
+
+    @property
+    def size(self) -> str:
+        return f"{self.width}x{self.height}"
+
+    def _key(self):
+        return tuple(getattr(self, name) for name in self._KEY_FIELDS)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GenerationSettings is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("GenerationSettings is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, GenerationSettings):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"GenerationSettings({fields})"
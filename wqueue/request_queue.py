@@ -1,39 +1,135 @@
 import asyncio
-from typing import Callable, Awaitable, Any
+import itertools
+import threading
+from collections import deque
+from typing import Callable, Awaitable, Any, Hashable, Optional
 import time
 
+class Job:
+    """Дескриптор задачи в очереди, через который её можно отменить.
+
+    Флаг отмены — threading.Event, чтобы его можно было проверять из потока,
+    в котором работает пайплайн, на границе каждого шага.
+    """
+
+    def __init__(self, job_id: int, task: Callable[..., Awaitable[Any]], args, kwargs, key: Hashable = None, owner: Hashable = None):
+        self.id = job_id
+        self.task = task
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.owner = owner
+        self.cancel_event = threading.Event()
+        self.committed = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def commit(self) -> bool:
+        """Отмечает, что задача прошла последнюю точку отмены (например, результат
+        готов и отправляется). Возвращает False, если задачу успели отменить раньше."""
+        if self.cancelled:
+            return False
+        self.committed = True
+        return True
+
 class RequestQueue:
     def __init__(self):
-        self.queue = asyncio.Queue()
-        self.current_task = None
+        self.pending = deque()
+        self.jobs = {}
+        self.keys = {}
+        self.has_jobs = asyncio.Event()
+        self.current_job = None
         self.start_time = None
+        self._ids = itertools.count(1)
+
+    async def add_task(self, task: Callable[..., Awaitable[Any]], *args, key: Hashable = None, owner: Hashable = None, **kwargs) -> Job:
+        """Ставит задачу в очередь. Задача получает свой Job в аргументе job.
 
-    async def add_task(self, task: Callable[..., Awaitable[Any]], *args, **kwargs):
-        await self.queue.put((task, args, kwargs))
+        Если задача с тем же key уже ждёт или выполняется, новая не создаётся
+        и возвращается существующая. Отменить задачу с owner может только владелец.
+        """
+        existing = self.find(key)
+        if existing is not None:
+            return existing
+
+        job = Job(next(self._ids), task, args, kwargs, key, owner)
+        self.jobs[job.id] = job
+        if key is not None:
+            self.keys[key] = job
+        self.pending.append(job)
+        self.has_jobs.set()
+        return job
+
+    def find(self, key: Hashable) -> Optional[Job]:
+        if key is None:
+            return None
+        job = self.keys.get(key)
+        if job is None or job.cancelled:
+            return None
+        return job
+
+    def get(self, job_id: int) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: int, owner: Hashable = None) -> bool:
+        """Отменяет задачу: ожидающая удаляется из очереди, выполняющаяся
+        прерывается на ближайшей границе шага. Возвращает False, если задачи уже нет
+        или её пытается отменить не владелец."""
+        job = self.jobs.get(job_id)
+        if job is None or job.cancelled or job.committed:
+            return False
+        if job.owner is not None and job.owner != owner:
+            return False
+        job.cancel()
+        if job in self.pending:
+            self.pending.remove(job)
+            self._forget(job)
+        return True
+
+    def _forget(self, job: Job):
+        self.jobs.pop(job.id, None)
+        if self.keys.get(job.key) is job:
+            del self.keys[job.key]
 
     async def process_queue(self):
         while True:
-            task, args, kwargs = await self.queue.get()
-            self.current_task = task.__name__
+            while not self.pending:
+                self.has_jobs.clear()
+                await self.has_jobs.wait()
+            job = self.pending.popleft()
+            self.current_job = job
             self.start_time = time.time()
             try:
-                await task(*args, **kwargs)
+                await job.task(*job.args, job=job, **job.kwargs)
             finally:
-                self.queue.task_done()
-                self.current_task = None
+                self._forget(job)
+                self.current_job = None
                 self.start_time = None
 
+    def position(self, job: Job) -> int:
+        """Позиция задачи в очереди, начиная с 1; 0 — задача уже не ожидает."""
+        try:
+            return self.pending.index(job) + 1
+        except ValueError:
+            return 0
+
     @property
     def queue_size(self):
-        return self.queue.qsize()
+        return len(self.pending)
 
     @property
     def current_task_name(self):
-        return self.current_task
+        if self.current_job is None:
+            return None
+        return self.current_job.task.__name__
 
     @property
     def elapsed_time(self):
         if self.start_time is None:
             return 0
         return time.time() - self.start_time
-